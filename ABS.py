@@ -1,30 +1,73 @@
+import contextlib
 import csv
+import math
+import multiprocessing
+import os
+import numpy as np
 import pandas as pd
+from collections import namedtuple
 from datetime import datetime
 
+try:
+    from numba import njit
+except ImportError:  # Numba is optional; the kernels then run as plain NumPy
+    def njit(*args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
 # ----- Dynamic/Tiered Fees -----
+FEE_TABLE_PERIODS = 1200  # Fee rates are tabulated up to 100 years of monthly periods
+
 class Fee:
+    __slots__ = ('name', 'base_rate', 'priority', 'tier_schedule', 'accrued', 'k_paid', 'k_accrued', '_rates')
+
     def __init__(self, name, base_rate, priority, tier_schedule=None):
         self.name = name
         self.base_rate = base_rate  # Default annual rate
         self.priority = priority
         self.tier_schedule = tier_schedule or []  # [(period_start, period_end, rate)]
         self.accrued = 0
+        # Output column names
+        self.k_paid = f'{name}_paid'
+        self.k_accrued = f'{name}_accrued'
+        # Rate per period as a lookup table; earlier tiers win where they overlap.
+        # Tier bounds may be floats or open-ended, so the table stops at a fixed horizon
+        last_end = max((end for _, end, _ in self.tier_schedule), default=-1)
+        horizon = int(max(min(last_end, FEE_TABLE_PERIODS), -1))
+        self._rates = np.full(horizon + 2, base_rate, dtype=np.float64)
+        for start, end, rate in reversed(self.tier_schedule):
+            lo = math.ceil(min(max(start, 0), horizon + 2))
+            hi = math.floor(max(min(end, horizon + 1), -1))
+            if lo <= hi:
+                self._rates[lo:hi + 1] = rate
 
     def get_rate(self, period, pool_balance):
+        if 0 <= period < len(self._rates) and period == int(period):
+            return self._rates[int(period)]
         for sched in self.tier_schedule:
             if sched[0] <= period <= sched[1]:
                 return sched[2]
         return self.base_rate
 
     def calculate(self, pool_balance, period):
-        rate = self.get_rate(period, pool_balance)
-        fee = pool_balance * rate / 12
+        fee = pool_balance * self.get_rate(period, pool_balance) / 12
         self.accrued += fee
         return fee
 
 # ----- Advanced IFRS/EIR & Stage Impairment -----
+# Share of expected loss recognized per IFRS 9 stage, indexed by stage number
+STAGE_COEF = np.array([0.0, 0.01, 0.03, 1.0])  # Stage 1: 1%, Stage 2: 3%, Stage 3 (default): 100%
+
+def _stage_coef(stage):
+    # Stages outside 1-3 recognize nothing, as with the original if/elif
+    stage = np.asarray(stage)
+    known = (stage >= 0) & (stage < len(STAGE_COEF))
+    return np.where(known, STAGE_COEF[np.where(known, stage, 0)], 0.0)
+
 class IFRSAccount:
+    __slots__ = ('eir', 'gross_carrying', 'stage', 'impairment', 'interest_income')
+
     def __init__(self, eir, gross_carrying, stage=1):
         self.eir = eir
         self.gross_carrying = gross_carrying
@@ -38,36 +81,41 @@ class IFRSAccount:
         return interest
 
     def recognize_impairment(self, expected_loss):
-        if self.stage == 1:
-            self.impairment += expected_loss * 0.01  # 1% for Stage 1
-        elif self.stage == 2:
-            self.impairment += expected_loss * 0.03  # 3% for Stage 2
-        elif self.stage == 3:
-            self.impairment += expected_loss  # 100% for default
+        self.impairment += expected_loss * _stage_coef(self.stage)
         return self.impairment
 
     def move_stage(self, stage):
         self.stage = stage
 
 # ----- Loan -----
+LoanStepResult = namedtuple('LoanStepResult', 'interest principal prepayment default cashflow remaining_principal')
+PoolStepResult = namedtuple('PoolStepResult', 'interest principal prepayment default losses remaining_principal')
+
 class Loan:
+    __slots__ = ('principal', 'rate', 'term', 'remaining_principal', 'active', '_payment')
+
     def __init__(self, principal, rate, term):
         self.principal = principal
         self.rate = rate
         self.term = term
         self.remaining_principal = principal
         self.active = True
+        # Principal, rate and term are fixed, so the level payment is too
+        self._payment = self._compute_payment()
 
-    def monthly_payment(self):
+    def _compute_payment(self):
         r = self.rate / 12
         n = self.term
         if r == 0:
             return self.principal / n
         return self.principal * (r * (1 + r) ** n) / ((1 + r) ** n - 1)
 
+    def monthly_payment(self):
+        return self._payment
+
     def step(self, prepay_rate=0, default_rate=0):
         if not self.active or self.remaining_principal <= 0:
-            return dict(interest=0, principal=0, prepayment=0, default=0, cashflow=0, remaining_principal=0)
+            return LoanStepResult(0, 0, 0, 0, 0, 0)
         payment = self.monthly_payment()
         interest = self.remaining_principal * self.rate / 12
         principal = payment - interest
@@ -82,17 +130,261 @@ class Loan:
         if self.remaining_principal < 1e-8:
             self.remaining_principal = 0
             self.active = False
-        return dict(
-            interest=interest,
-            principal=principal,
-            prepayment=prepayment,
-            default=default,
-            cashflow=cashflow,
-            remaining_principal=self.remaining_principal,
+        return LoanStepResult(interest, principal, prepayment, default, cashflow, self.remaining_principal)
+
+# ----- Loan Pool (structure-of-arrays) -----
+def payment_factor(rate, term):
+    """Level monthly payment per unit of principal for annual `rate` over `term` months."""
+    r = np.asarray(rate, dtype=np.float64) / 12
+    n = np.asarray(term, dtype=np.float64)
+    growth = (1 + r) ** n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(r == 0, 1 / n, r * growth / (growth - 1))
+
+class LoanPool:
+    """Whole loan pool held as parallel arrays in `dtype`; totals are summed in float64."""
+    def __init__(self, principal, rate, term, remaining=None, dtype=np.float64):
+        self.dtype = np.dtype(dtype)
+        self.principal = np.array(principal, dtype=self.dtype)
+        self.rate = np.array(rate, dtype=self.dtype)
+        self.term = np.array(term, dtype=self.dtype)
+        if remaining is None:
+            self.remaining = self.principal.copy()
+        else:
+            self.remaining = np.array(remaining, dtype=self.dtype)
+        # Invariant for the life of each loan, so computed once
+        self.r = self.rate / 12
+        self.pmt_factor = payment_factor(self.rate, self.term).astype(self.dtype)
+        self.payment = self.principal * self.pmt_factor
+        # Running pool balance, kept in step with every change to `remaining`
+        self.outstanding = self.remaining.sum(dtype=np.float64)
+        # Slot of each array entry, so balances map back to loans after compaction
+        self.ids = np.arange(len(self.remaining))
+        self._next_id = len(self.remaining)
+        self.loans = None
+        self._pending = []
+
+    @classmethod
+    def from_loans(cls, loans, dtype=np.float64):
+        if not isinstance(loans, list):
+            loans = list(loans)
+        pool = cls(
+            [l.principal for l in loans],
+            [l.rate for l in loans],
+            [l.term for l in loans],
+            remaining=[l.remaining_principal if l.active else 0 for l in loans],
+            dtype=dtype,
         )
+        pool.loans = loans
+        return pool
+
+    def __len__(self):
+        return len(self.remaining)
+
+    def _extend(self, principal, rate, term, remaining):
+        factor = payment_factor(rate, term)
+        def grow(arr, values):
+            return np.concatenate([arr, np.asarray(values, dtype=self.dtype)])
+        self.principal = grow(self.principal, principal)
+        self.rate = grow(self.rate, rate)
+        self.term = grow(self.term, term)
+        self.remaining = grow(self.remaining, remaining)
+        self.r = grow(self.r, np.asarray(rate) / 12)
+        self.pmt_factor = grow(self.pmt_factor, factor)
+        self.payment = grow(self.payment, np.asarray(principal) * factor)
+        self.ids = np.concatenate([self.ids, np.arange(self._next_id, self._next_id + len(factor))])
+        self._next_id += len(factor)
+        self.outstanding += np.sum(np.asarray(remaining, dtype=self.dtype), dtype=np.float64)
+
+    def append(self, loan):
+        if self.loans is not None:
+            # Pending originations come first so list order keeps matching the slots
+            self._originate_pending()
+            self.loans.append(loan)
+        self._extend(
+            [loan.principal], [loan.rate], [loan.term],
+            [loan.remaining_principal if loan.active else 0],
+        )
+
+    def add_loans(self, n, principal, rate, term):
+        """Originate `n` identical new loans in one batch."""
+        self._extend(np.full(n, principal), np.full(n, rate), np.full(n, term), np.full(n, principal))
+        # Loan objects are only built when the state is written back
+        self._pending.append((n, principal, rate, term))
+
+    def balance(self):
+        return self.outstanding
+
+    def compact(self):
+        """Drop paid-off loans so later steps only touch live balances."""
+        alive = self.remaining > 0
+        self.principal = self.principal[alive]
+        self.rate = self.rate[alive]
+        self.term = self.term[alive]
+        self.remaining = self.remaining[alive]
+        self.r = self.r[alive]
+        self.pmt_factor = self.pmt_factor[alive]
+        self.payment = self.payment[alive]
+        self.ids = self.ids[alive]
+
+    def _originate_pending(self):
+        for n, principal, rate, term in self._pending:
+            self.loans.extend(Loan(principal, rate, term) for _ in range(n))
+        self._pending = []
+
+    def write_back(self):
+        """Copy balances onto the source Loan objects and add the reinvested loans to their list."""
+        if self.loans is None:
+            return
+        self._originate_pending()
+        # Slots dropped by `compact` were paid off
+        balances = np.zeros(self._next_id)
+        balances[self.ids] = self.remaining
+        for loan, balance in zip(self.loans, balances.tolist()):
+            # Loans that were already inactive never entered the pool's balance
+            if loan.active:
+                loan.remaining_principal = balance
+                loan.active = balance > 0
+
+    def step(self, prepay_rate=0, default_rate=0, lgd=1.0):
+        """Vectorized `Loan.step` over every loan; returns pool totals."""
+        # Rates in the pool's dtype so float32 pools compute in float32 throughout
+        interest, principal, prepayment, default, losses, paydown, n_alive = _simulate_pool_step(
+            self.remaining, self.r, self.payment,
+            self.dtype.type(prepay_rate), self.dtype.type(default_rate), lgd,
+        )
+        self.outstanding -= paydown
+        if n_alive < 0.5 * len(self.remaining):
+            self.compact()
+        return PoolStepResult(interest, principal, prepayment, default, losses, self.outstanding)
+
+@njit(cache=True)
+def _simulate_pool_step(remaining, r, payment, cpr_m, cdr_m, lgd):
+    # Updates `remaining` in place, keeping the pool's dtype
+    # Loans with nothing outstanding are inactive and contribute nothing
+    zero = np.zeros_like(remaining)
+    interest = remaining * r
+    principal = np.where(remaining > 0, payment - interest, zero)
+    prepayment = cpr_m * remaining
+    default = cdr_m * remaining
+
+    new_remaining = remaining - np.minimum(remaining, principal + prepayment + default)
+    new_remaining = np.where(new_remaining < 1e-8, zero, new_remaining)
+    # Paydown is measured on the stored balances, in float64, so the running
+    # total tracks exactly what left the pool in its own dtype
+    opening = remaining.astype(np.float64)
+    remaining[:] = new_remaining
+    paydown = np.sum(opening - remaining.astype(np.float64))
+    total_default = np.sum(default, dtype=np.float64)
+    return (
+        np.sum(interest, dtype=np.float64),
+        np.sum(principal, dtype=np.float64),
+        np.sum(prepayment, dtype=np.float64),
+        total_default,
+        total_default * lgd,
+        paydown,
+        np.count_nonzero(remaining),
+    )
+
+# ----- Cohort Pool (closed-form amortization) -----
+def _unit_schedule(rate, term, cpr_m, cdr_m):
+    """Per-unit-principal cashflow rows and closing balances by loan age for one loan class."""
+    r = rate / 12
+    f = float(payment_factor(rate, term))
+    # bal[t+1] = a * bal[t] - f until the loan pays off
+    a = 1 + r - cpr_m - cdr_m
+    t = np.arange(term + 2, dtype=np.float64)
+    if a == 1:
+        bal = 1 - f * t
+    else:
+        growth = a ** t
+        bal = growth - f * (growth - 1) / (a - 1)
+    # Tolerance absorbs rounding in the closed form at the maturity date
+    paid_off = np.flatnonzero(bal < 1e-10)
+    if len(paid_off):
+        bal[paid_off[0]:] = 0.0
+
+    opening = bal[:-1]
+    interest = opening * r
+    principal = np.where(opening > 0, f - interest, 0.0)
+    # Rows: interest, principal, prepayment, default, paydown; the extra last column
+    # is all zeros so ages past maturity can index it
+    return np.vstack([interest, principal, cpr_m * opening, cdr_m * opening, opening - bal[1:]]), bal
+
+class CohortPool:
+    """Homogeneous pool (one rate and term, constant CPR/CDR) amortized in closed form."""
+    def __init__(self, principal, rate, term, cpr_m, cdr_m, loans=None):
+        self.rate = rate
+        self.term = int(term)
+        self.cpr_m = cpr_m
+        self.cdr_m = cdr_m
+        self.schedule, self.unit_balance = _unit_schedule(rate, self.term, cpr_m, cdr_m)
+        self.cohort_principal = np.array([principal], dtype=np.float64)
+        self.cohort_start = np.array([0])
+        self.t = 0
+        self.outstanding = float(principal)
+        self.loans = loans
+        # Loan objects of each cohort; reinvested cohorts stay (n, principal) until written back
+        self._cohort_loans = [list(loans) if loans is not None else []]
+
+    def add_loans(self, n, principal, rate, term):
+        """Originate `n` identical new loans as one cohort starting next period."""
+        if rate != self.rate or int(term) != self.term:
+            raise ValueError("CohortPool can only add loans with the pool's rate and term")
+        self.cohort_principal = np.append(self.cohort_principal, n * principal)
+        self.cohort_start = np.append(self.cohort_start, self.t)
+        self.outstanding += n * principal
+        self._cohort_loans.append((n, principal))
+
+    def balance(self):
+        return self.outstanding
+
+    def step(self, prepay_rate=0, default_rate=0, lgd=1.0):
+        """Same totals as `LoanPool.step`, read off the precomputed schedule."""
+        if prepay_rate != self.cpr_m or default_rate != self.cdr_m:
+            raise ValueError("CohortPool schedule was built for different prepayment/default rates")
+        ages = np.minimum(self.t - self.cohort_start, self.term)
+        interest, principal, prepayment, default, paydown = self.schedule[:, ages] @ self.cohort_principal
+        self.t += 1
+        self.outstanding -= paydown
+        return PoolStepResult(interest, principal, prepayment, default, default * lgd, self.outstanding)
+
+    def write_back(self):
+        """Set each loan's balance from its cohort's age and add the reinvested loans to the list."""
+        if self.loans is None:
+            return
+        ages = np.minimum(self.t - self.cohort_start, self.term + 1)
+        for k, cohort in enumerate(self._cohort_loans):
+            if isinstance(cohort, tuple):
+                n, principal = cohort
+                cohort = [Loan(principal, self.rate, self.term) for _ in range(n)]
+                self._cohort_loans[k] = cohort
+                self.loans.extend(cohort)
+            unit = float(self.unit_balance[ages[k]])
+            for loan in cohort:
+                loan.remaining_principal = loan.principal * unit
+                loan.active = loan.remaining_principal > 0
+
+def build_pool(loans, loan_rate, loan_term, cpr_m, cdr_m):
+    """CohortPool when every loan is new and matches the reinvestment terms, else LoanPool."""
+    if not isinstance(loans, list):
+        loans = list(loans)
+    if loans and all(
+        l.active and l.remaining_principal == l.principal and l.rate == loan_rate and l.term == loan_term
+        for l in loans
+    ):
+        return CohortPool(sum(l.principal for l in loans), loan_rate, loan_term, cpr_m, cdr_m, loans=loans)
+    return LoanPool.from_loans(loans)
 
 # ----- Tranche (with IFRS) -----
 class Tranche:
+    __slots__ = (
+        'name', 'principal', 'rate', 'remaining_principal', 'subordination_level', 'ifrs',
+        'interest_due', 'interest_paid', 'principal_paid', 'losses',
+        'k_interest_paid', 'k_principal_paid', 'k_losses', 'k_outstanding',
+        'k_ifrs_int', 'k_ifrs_imp', 'k_stage', 'k_call_redemption',
+    )
+
     def __init__(self, name, principal, rate, subordination_level, eir=None):
         self.name = name
         self.principal = principal
@@ -104,6 +396,14 @@ class Tranche:
         self.interest_paid = 0
         self.principal_paid = 0
         self.losses = 0
+        self.k_interest_paid = f'{name}_interest_paid'
+        self.k_principal_paid = f'{name}_principal_paid'
+        self.k_losses = f'{name}_losses'
+        self.k_outstanding = f'{name}_outstanding'
+        self.k_ifrs_int = f'{name}_ifrs_interest_income'
+        self.k_ifrs_imp = f'{name}_ifrs_impairment'
+        self.k_stage = f'{name}_stage'
+        self.k_call_redemption = f'{name}_call_redemption'
 
     def pay_interest(self, cash_available):
         interest = self.remaining_principal * self.rate / 12
@@ -130,8 +430,66 @@ class Tranche:
         self.ifrs.recognize_impairment(applied)
         return loss - applied
 
+# ----- Tranche Pool (structure-of-arrays) -----
+class TranchePool:
+    """Tranche balances and IFRS bookkeeping as arrays, ordered senior to junior."""
+    def __init__(self, tranches):
+        self.tranches = tuple(sorted(tranches, key=lambda t: t.subordination_level))
+        ts = self.tranches
+        self.remaining = np.array([t.remaining_principal for t in ts], dtype=np.float64)
+        self.rate = np.array([t.rate for t in ts], dtype=np.float64)
+        self.subord = np.array([t.subordination_level for t in ts])
+        self.eir = np.array([t.ifrs.eir for t in ts], dtype=np.float64)
+        self.gross_carrying = np.array([t.ifrs.gross_carrying for t in ts], dtype=np.float64)
+        self.interest_income = np.array([t.ifrs.interest_income for t in ts], dtype=np.float64)
+        self.impairment = np.array([t.ifrs.impairment for t in ts], dtype=np.float64)
+        self.stage = np.array([t.ifrs.stage for t in ts], dtype=np.int8)
+        self.losses = np.array([t.losses for t in ts], dtype=np.float64)
+        self.interest_due = np.array([t.interest_due for t in ts], dtype=np.float64)
+        self.interest_paid = np.array([t.interest_paid for t in ts], dtype=np.float64)
+        self.principal_paid = np.array([t.principal_paid for t in ts], dtype=np.float64)
+        # Running notes balance, reduced by every principal payment and loss
+        self.outstanding = self.remaining.sum()
+
+    def balance(self):
+        return self.outstanding
+
+    def pay_interest(self, paid):
+        self.interest_due = self.remaining * self.rate / 12
+        self.interest_paid = paid
+        self.interest_income += self.gross_carrying * self.eir / 12
+
+    def pay_principal(self, paid):
+        self.principal_paid = paid
+        self.remaining -= paid
+        self.outstanding -= paid.sum()
+        self.gross_carrying = self.remaining.copy()
+
+    def allocate_loss(self, applied):
+        self.losses += applied
+        self.remaining -= applied
+        self.outstanding -= applied.sum()
+        # Example: move to Stage 3 if loss applied
+        self.stage = np.where(applied > 0, 3, self.stage).astype(np.int8)
+        self.impairment += _stage_coef(self.stage) * applied
+
+    def write_back(self):
+        """Copy the array state back onto the Tranche objects."""
+        for i, tranche in enumerate(self.tranches):
+            tranche.remaining_principal = float(self.remaining[i])
+            tranche.interest_due = float(self.interest_due[i])
+            tranche.interest_paid = float(self.interest_paid[i])
+            tranche.principal_paid = float(self.principal_paid[i])
+            tranche.losses = float(self.losses[i])
+            tranche.ifrs.gross_carrying = float(self.gross_carrying[i])
+            tranche.ifrs.interest_income = float(self.interest_income[i])
+            tranche.ifrs.impairment = float(self.impairment[i])
+            tranche.ifrs.stage = int(self.stage[i])
+
 # ----- Reserve -----
 class ReserveAccount:
+    __slots__ = ('target', 'balance')
+
     def __init__(self, target):
         self.target = target
         self.balance = 0
@@ -149,48 +507,32 @@ class ReserveAccount:
 
 # ----- Waterfall -----
 def waterfall(tranches, reserve, fees, total_interest, total_principal, total_losses, triggers, pool_balance, period, pro_rata_start=36, turbo_redemption=True):
+    """One period's payments; `tranches` is a TranchePool and `fees` must be ordered by priority."""
     cash_interest = total_interest
     cash_principal = total_principal
     losses = total_losses
     results = {}
 
     # 1. Fees by priority
-    fees_paid = {}
-    for fee in sorted(fees, key=lambda f: f.priority):
+    for fee in fees:
         pay = min(fee.calculate(pool_balance, period), cash_interest)
-        fees_paid[fee.name] = pay
+        results[fee.k_paid] = pay
         cash_interest -= pay
-    results['fees_paid'] = fees_paid
 
-    # 2. Interest payments
-    for tranche in sorted(tranches, key=lambda t: t.subordination_level):
-        pay = tranche.pay_interest(cash_interest)
-        cash_interest -= pay
-        results[f'{tranche.name}_interest_paid'] = pay
-
-    # 3. Principal payments
-    if period < pro_rata_start:
-        # Sequential (turbo)
-        for tranche in sorted(tranches, key=lambda t: t.subordination_level):
-            pay = tranche.pay_principal(cash_principal)
-            cash_principal -= pay
-            results[f'{tranche.name}_principal_paid'] = pay
-    else:
-        # Pro-rata
-        total_outstanding = sum(tr.remaining_principal for tr in tranches)
-        for tranche in tranches:
-            share = (tranche.remaining_principal / total_outstanding) if total_outstanding > 0 else 0
-            pay = min(cash_principal * share, tranche.remaining_principal)
-            pay = min(pay, cash_principal)
-            pay = max(pay, 0)
-            tranche.pay_principal(pay)
-            cash_principal -= pay
-            results[f'{tranche.name}_principal_paid'] = pay
-
-    # 4. Allocate losses (junior first)
-    for tranche in sorted(tranches, key=lambda t: -t.subordination_level):
-        losses = tranche.allocate_loss(losses, period)
-        results[f'{tranche.name}_losses'] = tranche.losses
+    # 2.-4. Interest, principal and losses on the tranche balances
+    interest_paid, principal_paid, loss_applied, cash_interest, cash_principal = _waterfall_numeric(
+        tranches.remaining, tranches.rate,
+        cash_interest, cash_principal, losses,
+        period >= pro_rata_start,
+    )
+    tranches.pay_interest(interest_paid)
+    tranches.pay_principal(principal_paid)
+    tranches.allocate_loss(loss_applied)
+
+    for i, tranche in enumerate(tranches.tranches):
+        results[tranche.k_interest_paid] = interest_paid[i]
+        results[tranche.k_principal_paid] = principal_paid[i]
+        results[tranche.k_losses] = tranches.losses[i]
 
     # 5. Reserve
     reserve_fill = reserve.fill(cash_interest + cash_principal)
@@ -198,6 +540,45 @@ def waterfall(tranches, reserve, fees, total_interest, total_principal, total_lo
 
     return results, cash_principal
 
+@njit(cache=True)
+def _sequential_allocation(amounts, cash):
+    """Pay `amounts` in order out of `cash`; each is paid in full before the next."""
+    # A plain min/subtract loop so a fully covered amount is paid exactly, leaving no dust
+    paid = np.zeros_like(amounts)
+    for i in range(amounts.shape[0]):
+        pay = min(amounts[i], cash)
+        if pay > 0:
+            paid[i] = pay
+            cash -= pay
+    return paid
+
+@njit(cache=True)
+def _waterfall_numeric(remaining, rate, cash_interest, cash_principal, losses, pro_rata):
+    """Cash allocation over tranche arrays ordered senior to junior."""
+    n = remaining.shape[0]
+
+    # Interest, senior first
+    interest_paid = _sequential_allocation(remaining * rate / 12, cash_interest)
+    cash_interest -= interest_paid.sum()
+
+    # Principal: sequential (turbo) or pro-rata on outstanding balances
+    if pro_rata:
+        total_outstanding = remaining.sum()
+        if total_outstanding > 0:
+            shares = remaining / total_outstanding
+        else:
+            shares = np.zeros(n)
+        principal_paid = np.minimum(max(cash_principal, 0.0) * shares, remaining)
+    else:
+        principal_paid = _sequential_allocation(remaining, cash_principal)
+    remaining = remaining - principal_paid
+    cash_principal -= principal_paid.sum()
+
+    # Losses, junior first: the same exact sequential allocation over the reversed stack
+    loss_applied = _sequential_allocation(remaining[::-1], losses)[::-1]
+
+    return interest_paid, principal_paid, loss_applied, cash_interest, cash_principal
+
 # ----- Callable Feature -----
 class CallableOption:
     def __init__(self, call_period, call_price_pct=1.0):
@@ -211,82 +592,136 @@ class CallableOption:
         return self.called
 
 # ----- Main Simulation -----
-def simulate_abs(pool, tranches, reserve, fees, callable_opt, periods, loan_rate, loan_term, cpr=0.05, cdr=0.01, lgd=1.0, turbo_redemption=True, pro_rata_start=36, csv_file="abs_cashflows.csv", excel_file="abs_cashflows.xlsx"):
-    history = []
-    for t in range(periods):
-        period = dict(month=t+1, date=(datetime.today() + pd.DateOffset(months=t)).strftime('%Y-%m-%d'))
-        period['total_interest'] = 0
-        period['total_principal'] = 0
-        period['total_prepayment'] = 0
-        period['total_default'] = 0
-        period['total_losses'] = 0
-
-        for loan in pool:
-            cf = loan.step(prepay_rate=cpr/12, default_rate=cdr/12)
-            period['total_interest'] += cf['interest']
-            period['total_principal'] += cf['principal'] + cf['prepayment']
-            period['total_prepayment'] += cf['prepayment']
-            period['total_default'] += cf['default']
-            period['total_losses'] += cf['default'] * lgd
-
-        pool_balance = sum(l.remaining_principal for l in pool)
-        notes_balance = sum(tr.remaining_principal for tr in tranches)
-
-        # Callable feature
-        if callable_opt and callable_opt.check_call(period=t+1, pool_balance=pool_balance, call_trigger=0.05 * notes_balance):
-            for tranche in tranches:
-                pay = tranche.remaining_principal * callable_opt.call_price_pct
-                tranche.pay_principal(pay)
-                period[f'{tranche.name}_call_redemption'] = pay
-            period['called'] = True
-            history.append(period)
-            break
-
-        # Waterfall
-        wf, leftover_principal = waterfall(
-            tranches, reserve, fees,
-            period['total_interest'],
-            period['total_principal'],
-            period['total_losses'],
-            triggers=None,
-            pool_balance=pool_balance,
-            period=t+1,
-            pro_rata_start=pro_rata_start,
-            turbo_redemption=turbo_redemption
-        )
-        period.update(wf)
-
-        # Reinvestment logic (example: only before pro-rata)
-        if t+1 < pro_rata_start:
-            loan_size = 100000
-            while leftover_principal >= loan_size:
-                pool.append(Loan(loan_size, loan_rate, loan_term))
-                leftover_principal -= loan_size
-        period['reinvested_principal'] = period['total_principal'] - leftover_principal
-
-        for tranche in tranches:
-            period[f'{tranche.name}_outstanding'] = tranche.remaining_principal
-            period[f'{tranche.name}_ifrs_interest_income'] = tranche.ifrs.interest_income
-            period[f'{tranche.name}_ifrs_impairment'] = tranche.ifrs.impairment
-            period[f'{tranche.name}_stage'] = tranche.ifrs.stage
-        for fee in fees:
-            period[f'{fee.name}_accrued'] = fee.accrued
-        period['reserve_balance'] = reserve.balance
-        period['pool_balance'] = pool_balance
-        history.append(period)
-
-        # Early exit: all tranches paid off
-        if all(abs(tr.remaining_principal) < 1e-8 for tr in tranches):
-            break
-
-    # Export to CSV/Excel
-    df = pd.DataFrame(history)
-    df.to_csv(csv_file, index=False)
-    df.to_excel(excel_file, index=False)
-    return history
-
-# ----- Example usage -----
-if __name__ == "__main__":
+def _monthly_dates(start, periods):
+    """`start + pd.DateOffset(months=t)` for every period, as 'YYYY-MM-DD' strings."""
+    months = np.datetime64(start, 'M') + np.arange(periods)
+    first_day = months.astype('datetime64[D]')
+    # Same day of month as `start`, clipped to the end of shorter months
+    last_offset = (months + 1).astype('datetime64[D]') - first_day - np.timedelta64(1, 'D')
+    offset = np.minimum(np.timedelta64(start.day - 1, 'D'), last_offset)
+    return np.datetime_as_string(first_day + offset, unit='D')
+
+def history_columns(tranches, fees):
+    """Fixed output schema as (column, dtype) pairs, in CSV column order."""
+    amount = np.float64
+    columns = [('month', np.int64), ('date', 'U10')]
+    columns += [(name, amount) for name in ('total_interest', 'total_principal', 'total_prepayment', 'total_default', 'total_losses')]
+    columns += [(fee.k_paid, amount) for fee in fees]
+    columns += [(tranche.k_interest_paid, amount) for tranche in tranches]
+    columns += [(tranche.k_principal_paid, amount) for tranche in tranches]
+    columns += [(tranche.k_losses, amount) for tranche in tranches]
+    columns += [('reserve_fill', amount), ('reinvested_principal', amount)]
+    for tranche in tranches:
+        columns += [
+            (tranche.k_outstanding, amount),
+            (tranche.k_ifrs_int, amount),
+            (tranche.k_ifrs_imp, amount),
+            (tranche.k_stage, np.int8),
+        ]
+    columns += [(fee.k_accrued, amount) for fee in fees]
+    columns += [('reserve_balance', amount), ('pool_balance', amount)]
+    columns += [(tranche.k_call_redemption, amount) for tranche in tranches]
+    columns += [('called', bool)]
+    return columns
+
+def _history_buffers(periods, tranches, fees):
+    """Pre-allocated output columns, one array of length `periods` per column."""
+    # Zero-filled, so values a period never sets (e.g. the waterfall in the call month) read as 0
+    cols = {name: np.zeros(periods, dtype=dtype) for name, dtype in history_columns(tranches, fees)}
+    cols['month'][:] = np.arange(1, periods + 1)
+    cols['date'][:] = _monthly_dates(datetime.today(), periods)
+    return cols
+
+def simulate_abs(pool, tranches, reserve, fees, callable_opt, periods, loan_rate, loan_term, cpr=0.05, cdr=0.01, lgd=1.0, turbo_redemption=True, pro_rata_start=36, csv_file="abs_cashflows.csv", excel_file=None):
+    """Run the deal and return the period history as a DataFrame."""
+    if not isinstance(pool, (LoanPool, CohortPool)):
+        pool = build_pool(pool, loan_rate, loan_term, cpr/12, cdr/12)
+    cols = _history_buffers(periods, tranches, fees)
+    # Payment orders are fixed for the life of the deal
+    tranche_pool = TranchePool(tranches)
+    fees_by_prio = tuple(sorted(fees, key=lambda f: f.priority))
+    n_rows = 0
+    # Rows are streamed to the CSV as each period completes
+    with open(csv_file, 'w', newline='') if csv_file else contextlib.nullcontext() as csv_out:
+        writer = csv.writer(csv_out, quoting=csv.QUOTE_MINIMAL, lineterminator='\n') if csv_out else None
+        if writer:
+            writer.writerow(cols)
+        for t in range(periods):
+            cf = pool.step(prepay_rate=cpr/12, default_rate=cdr/12, lgd=lgd)
+            total_principal = cf.principal + cf.prepayment
+            cols['total_interest'][t] = cf.interest
+            cols['total_principal'][t] = total_principal
+            cols['total_prepayment'][t] = cf.prepayment
+            cols['total_default'][t] = cf.default
+            cols['total_losses'][t] = cf.losses
+
+            pool_balance = cf.remaining_principal
+            notes_balance = tranche_pool.balance()
+
+            # Callable feature
+            called = bool(callable_opt) and callable_opt.check_call(period=t+1, pool_balance=pool_balance, call_trigger=0.05 * notes_balance)
+            if called:
+                pay = tranche_pool.remaining * callable_opt.call_price_pct
+                tranche_pool.pay_principal(np.minimum(pay, tranche_pool.remaining))
+                for i, tranche in enumerate(tranche_pool.tranches):
+                    cols[tranche.k_call_redemption][t] = pay[i]
+                    cols[tranche.k_losses][t] = tranche_pool.losses[i]
+                cols['called'][t] = True
+            else:
+                # Waterfall
+                wf, leftover_principal = waterfall(
+                    tranche_pool, reserve, fees_by_prio,
+                    cf.interest,
+                    total_principal,
+                    cf.losses,
+                    triggers=None,
+                    pool_balance=pool_balance,
+                    period=t+1,
+                    pro_rata_start=pro_rata_start,
+                    turbo_redemption=turbo_redemption
+                )
+                for key, value in wf.items():
+                    cols[key][t] = value
+
+                # Reinvestment logic (example: only before pro-rata)
+                if t+1 < pro_rata_start:
+                    loan_size = 100000
+                    n_new = int(leftover_principal // loan_size)
+                    if n_new > 0:
+                        pool.add_loans(n_new, loan_size, loan_rate, loan_term)
+                        leftover_principal -= n_new * loan_size
+                cols['reinvested_principal'][t] = total_principal - leftover_principal
+
+            for i, tranche in enumerate(tranche_pool.tranches):
+                cols[tranche.k_outstanding][t] = tranche_pool.remaining[i]
+                cols[tranche.k_ifrs_int][t] = tranche_pool.interest_income[i]
+                cols[tranche.k_ifrs_imp][t] = tranche_pool.impairment[i]
+                cols[tranche.k_stage][t] = tranche_pool.stage[i]
+            for fee in fees:
+                cols[fee.k_accrued][t] = fee.accrued
+            cols['reserve_balance'][t] = reserve.balance
+            cols['pool_balance'][t] = pool_balance
+            n_rows = t + 1
+            if writer:
+                writer.writerow([values[t] for values in cols.values()])
+
+            # Early exit: called, or all tranches paid off
+            if called or np.all(np.abs(tranche_pool.remaining) < 1e-8):
+                break
+    # Final balances go back onto the tranches and loans; reinvested loans join the pool list
+    tranche_pool.write_back()
+    pool.write_back()
+
+    # Export to Excel
+    df = pd.DataFrame({name: values[:n_rows] for name, values in cols.items()})
+    if excel_file:
+        # xlsxwriter's constant_memory mode can't be used: pandas writes cells column by column
+        df.to_excel(excel_file, index=False, engine='xlsxwriter')
+    return df
+
+# ----- Scenario Runs -----
+def build_example_deal():
+    """Fresh pool, tranches, reserve, fees and call option for the example deal."""
     pool = [Loan(100000, 0.05, 360) for _ in range(100)]
     pool_principal = sum(l.principal for l in pool)
 
@@ -305,6 +740,30 @@ if __name__ == "__main__":
     ]
 
     callable_opt = CallableOption(call_period=36, call_price_pct=1.0)
+    return pool, tranches, reserve, fees, callable_opt
+
+def run_scenario(scenario):
+    """Run the example deal under one (cpr, cdr, lgd) scenario; returns (scenario, history)."""
+    cpr, cdr, lgd = scenario
+    # Each worker builds its own deal; nothing mutable is shared between processes
+    pool, tranches, reserve, fees, callable_opt = build_example_deal()
+    history = simulate_abs(
+        pool, tranches, reserve, fees, callable_opt,
+        periods=360, loan_rate=0.05, loan_term=360,
+        cpr=cpr, cdr=cdr, lgd=lgd,
+        turbo_redemption=True, pro_rata_start=36,
+        csv_file=None,
+    )
+    return scenario, history
+
+def run_scenarios(scenarios, processes=None):
+    """Run scenarios in parallel worker processes; returns (scenario, history) pairs in completion order."""
+    with multiprocessing.Pool(processes or os.cpu_count()) as workers:
+        return list(workers.imap_unordered(run_scenario, scenarios))
+
+# ----- Example usage -----
+if __name__ == "__main__":
+    pool, tranches, reserve, fees, callable_opt = build_example_deal()
 
     results = simulate_abs(
         pool, tranches, reserve, fees, callable_opt,
@@ -316,5 +775,13 @@ if __name__ == "__main__":
     )
 
     print("First 12 months, see CSV/Excel for all results:")
-    import pprint
-    pprint.pprint(results[:12])
\ No newline at end of file
+    print(results.head(12).to_string())
+
+    # Prepayment/default sensitivity, one process per scenario
+    scenarios = [(cpr, cdr, 1.0) for cpr in (0.02, 0.06, 0.10) for cdr in (0.01, 0.02, 0.04)]
+    sweep = dict(run_scenarios(scenarios))
+    print("\nTranche losses by scenario (cpr, cdr, lgd):")
+    for scenario in scenarios:
+        history = sweep[scenario]
+        losses = {tr.name: round(float(history[tr.k_losses].max()), 2) for tr in tranches}
+        print(scenario, f"{len(history)} months", losses)